@@ -29,6 +29,7 @@ class SerializedTorchPolicy(TorchPolicy):
     :param spaces_dict_file: Path to dumped spaces configuration (action and observation spaces of
                                   the env the policy was trained on, used for model initialization)
     :param deterministic: If True actions are computed deterministically; else sample from the probability distribution.
+    :param jit_script: If True, the policy networks are compiled with torch.jit.script for inference.
     """
 
     def __init__(self,
@@ -36,7 +37,8 @@ class SerializedTorchPolicy(TorchPolicy):
                  state_dict_file: str,
                  spaces_dict_file: str,
                  device: str,
-                 deterministic: bool):
+                 deterministic: bool,
+                 jit_script: bool = False):
         spaces_config = SpacesConfig.load(spaces_dict_file)
         model_composer = Factory(base_type=BaseModelComposer).instantiate(
             model,
@@ -48,7 +50,9 @@ class SerializedTorchPolicy(TorchPolicy):
         super().__init__(networks=model_composer.policy.networks,
                          distribution_mapper=model_composer.distribution_mapper,
                          device=device,
-                         substeps_with_separate_agent_nets=model_composer.policy.substeps_with_separate_agent_nets)
+                         substeps_with_separate_agent_nets=model_composer.policy.substeps_with_separate_agent_nets,
+                         jit_script=jit_script,
+                         rollout_only=True)
 
         state_dict = torch.load(state_dict_file, map_location=torch.device(self._device))
 
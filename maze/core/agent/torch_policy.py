@@ -1,6 +1,9 @@
 """Encapsulation of multiple torch policies for training and rollouts in structured environments."""
-from typing import Mapping, Union, List, Dict, Tuple, Sequence, Optional
+import contextlib
+from collections import defaultdict
+from typing import Mapping, Union, List, Dict, Tuple, Sequence, Optional, Callable, ContextManager
 
+import numpy as np
 import torch
 from torch import nn
 
@@ -17,6 +20,7 @@ from maze.core.trajectory_recording.records.structured_spaces_record import Stru
 from maze.distributions.categorical import CategoricalProbabilityDistribution
 from maze.distributions.distribution_mapper import DistributionMapper
 from maze.perception.perception_utils import convert_to_torch, convert_to_numpy
+from maze.utils.bcolors import BColors
 
 
 class TorchPolicy(TorchModel, Policy):
@@ -26,23 +30,103 @@ class TorchPolicy(TorchModel, Policy):
     :param networks: Mapping of policy networks to encapsulate
     :param distribution_mapper: Distribution mapper associated with the policy mapping.
     :param device: Device the policy should be located on (cpu or cuda)
+    :param substeps_with_separate_agent_nets: Sub-steps for which each agent has its own network.
+    :param compile_networks: If True, the forward passes of the policy networks (including the split into action
+                             and embedding logits) are run through torch.compile (requires torch >= 2.0).
+                             For networks with categorical action heads only, action sampling in
+                             :meth:`compute_action` is compiled together with the forward pass.
+                             Parameters and state dicts are still handled via the original (eager) networks.
+    :param cuda_graphs: If True and the policy is located on a cuda device, inference forward passes (i.e., with
+                        gradient computation disabled) are captured once per network and input shape as CUDA graph
+                        and replayed afterwards.
+    :param jit_script: If True, the policy networks are compiled with torch.jit.script for inference (requires
+                       rollout_only). Networks that are not scriptable are kept as they are.
+    :param rollout_only: Indicates that the policy is used for inference only (e.g., in rollout workers).
+    :param amp_dtype: If set (e.g., torch.bfloat16) and the policy is located on a cuda device, the network forward
+                      passes are run under torch.autocast with this dtype. The network outputs are cast back to float32
+                      before the probability distributions are initialized.
     """
 
     def __init__(self,
                  networks: Mapping[Union[str, int], nn.Module],
                  distribution_mapper: DistributionMapper,
                  device: str,
-                 substeps_with_separate_agent_nets: Optional[List[StepKeyType]] = None):
+                 substeps_with_separate_agent_nets: Optional[List[StepKeyType]] = None,
+                 compile_networks: bool = False,
+                 cuda_graphs: bool = False,
+                 jit_script: bool = False,
+                 rollout_only: bool = False,
+                 amp_dtype: Optional[torch.dtype] = None):
         self.networks = networks
         self.distribution_mapper = distribution_mapper
+        self._action_keys = frozenset(distribution_mapper.action_space.spaces.keys())
+        self._output_partitions: Dict[Union[StepKeyType, ActorID], Tuple[Tuple[str, ...], Tuple[str, ...]]] = dict()
+
+        # networks used for the forward passes (scripted if configured), along with the forward functions wrapping
+        # them; both are built lazily and dropped whenever the device or the state of the networks changes
+        self._forward_networks: Dict[Union[str, int], nn.Module] = dict()
+        self._forward_fns: Dict[Union[StepKeyType, ActorID], Callable[[Dict[str, torch.Tensor]], Tuple[
+            Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]]] = dict()
+        self._sample_fns: Dict[Union[StepKeyType, ActorID], Callable[[Dict[str, torch.Tensor], bool],
+                                                                     Dict[str, torch.Tensor]]] = dict()
+
+        # per network, whether all action heads are categorical (determined on the first action computation)
+        self._categorical_only: Dict[Union[StepKeyType, ActorID], bool] = dict()
+
+        # compiled functions share their parameters with the original networks,
+        # hence to(), train(), eval() and state dict handling keep working on self.networks
+        assert not compile_networks or hasattr(torch, "compile"), "compiling policy networks requires torch >= 2.0"
+        self._compile_networks = compile_networks
+
+        # scripted modules are not trained, hence they are only used for pure inference
+        if jit_script and not rollout_only:
+            raise ValueError("scripting policy networks (jit_script) is only supported for rollout_only policies")
+        assert not (jit_script and compile_networks), "torch.compile and torch.jit.script are mutually exclusive"
+        self._jit_script = jit_script
+
+        self._amp_dtype = amp_dtype
+
+        # batch normalization layers per network, which prevent batching multiple sub-steps in training mode
+        self._batch_norm_layers: Dict[Union[StepKeyType, ActorID], List[nn.modules.batchnorm._BatchNorm]] = dict()
+
+        # cuda streams for overlapping the forward passes of independent networks
+        self._streams: List[torch.cuda.Stream] = list()
+
+        # pinned host memory staging buffers for asynchronous host to device copies during rollouts
+        self._pinned_buffers: Dict[Tuple[str, Tuple[int, ...], np.dtype], torch.Tensor] = dict()
+
+        # captured CUDA graphs along with their static input and output buffers
+        self._use_cuda_graphs = cuda_graphs
+        self._cuda_graphs: Dict[Tuple, Tuple[torch.cuda.CUDAGraph, Dict[str, torch.Tensor],
+                                             Dict[str, torch.Tensor]]] = dict()
 
         if substeps_with_separate_agent_nets is not None:
             self.substeps_with_separate_agent_nets = set(substeps_with_separate_agent_nets)
         else:
             self.substeps_with_separate_agent_nets = set()
 
+        # network keys resolved per actor, to avoid re-evaluating the lookup logic on every forward pass
+        # (separated agent networks are keyed by actor already, hence the table is pre-populated with those)
+        self._single_network_key = next(iter(networks.keys())) if len(networks) == 1 else None
+        self._actor_network_keys: Dict[ActorID, Union[StepKeyType, ActorID]] = {
+            ActorID(*key): key for key in networks.keys() if isinstance(key, tuple)}
+
         TorchModel.__init__(self, device=device)
 
+    @staticmethod
+    def _script_network(network: nn.Module) -> nn.Module:
+        """Script the given network for inference, falling back to the original network if it is not scriptable.
+
+        :param network: The network to script.
+        :return: The scripted network (in eval mode) or the original network.
+        """
+        try:
+            return torch.jit.script(network).eval()
+        except (RuntimeError, torch.jit.frontend.NotSupportedError) as e:
+            BColors.print_colored(f"WARNING: Could not script policy network {type(network).__name__}, "
+                                  f"falling back to eager mode ({e})", BColors.WARNING)
+            return network
+
     @override(Policy)
     def seed(self, seed: int) -> None:
         """This is done globally"""
@@ -66,6 +150,7 @@ class TorchPolicy(TorchModel, Policy):
     def eval(self) -> None:
         """implementation of :class:`~maze.core.agent.torch_model.TorchModel`
         """
+        self._cuda_graphs.clear()
         for policy in self.networks.values():
             policy.eval()
 
@@ -73,6 +158,7 @@ class TorchPolicy(TorchModel, Policy):
     def train(self) -> None:
         """implementation of :class:`~maze.core.agent.torch_model.TorchModel`
         """
+        self._cuda_graphs.clear()
         for policy in self.networks.values():
             policy.train()
 
@@ -81,6 +167,12 @@ class TorchPolicy(TorchModel, Policy):
         """implementation of :class:`~maze.core.agent.torch_model.TorchModel`
         """
         self._device = device
+        self._device_type = torch.device(device).type
+        self._cuda_graphs.clear()
+        self._streams = list()
+        self._forward_networks.clear()
+        self._forward_fns.clear()
+        self._sample_fns.clear()
         for policy in self.networks.values():
             policy.to(device)
 
@@ -101,6 +193,11 @@ class TorchPolicy(TorchModel, Policy):
         """
         if "policies" in state_dict:
             state_dict_policies = state_dict["policies"]
+            self._cuda_graphs.clear()
+            if self._jit_script:
+                self._forward_networks.clear()
+                self._forward_fns.clear()
+                self._sample_fns.clear()
 
             for key, policy in self.networks.items():
                 assert key in state_dict_policies, f"Could not find state dict for policy ID: {key}"
@@ -116,11 +213,31 @@ class TorchPolicy(TorchModel, Policy):
         """implementation of :class:`~maze.core.agent.policy.Policy`
         """
         with torch.no_grad():
+            if self._device_type != "cpu":
+                observation = self._convert_to_torch_pinned(observation)
+
+            network_key = self._network_key_for(actor_id)
+            if self._categorical_only.get(network_key, False):
+                with self._autocast():
+                    action = self._sample_fn_for(network_key)(self._maybe_convert_to_torch(observation),
+                                                              deterministic)
+                return convert_to_numpy(action, cast=None, in_place=False)
+
             policy_out = self.compute_substep_policy_output(observation, actor_id)
             if deterministic:
                 action = policy_out.prob_dist.deterministic_sample()
             else:
                 action = policy_out.prob_dist.sample()
+
+            if self._compile_networks and network_key not in self._categorical_only:
+                self._categorical_only[network_key] = \
+                    not (self._use_cuda_graphs and self._device_type == "cuda") and \
+                    all(type(dist) is CategoricalProbabilityDistribution
+                        for dist in policy_out.prob_dist.distribution_dict.values())
+
+            # release the logits and distribution before the host transfer, so that the caching allocator can reuse
+            # their memory blocks right away
+            del policy_out
         return convert_to_numpy(action, cast=None, in_place=False)
 
     @override(Policy)
@@ -151,12 +268,24 @@ class TorchPolicy(TorchModel, Policy):
         :param actor_id: Actor ID to get a network for
         :return: Network corresponding to the given policy ID.
         """
-        if actor_id is None:
-            assert len(self.networks) == 1, "multiple networks are available, please specify the actor ID explicitly"
-            return list(self.networks.values())[0]
+        return self.networks[self._network_key_for(actor_id)]
+
+    def _network_key_for(self, actor_id: Optional[ActorID]) -> Union[StepKeyType, ActorID]:
+        """Resolve the key of the network (in self.networks) responsible for the given actor.
+
+        :param actor_id: Actor ID to get the network key for
+        :return: The network key.
+        """
+        if self._single_network_key is not None:
+            return self._single_network_key
 
-        network_key = actor_id if actor_id.step_key in self.substeps_with_separate_agent_nets else actor_id.step_key
-        return self.networks[network_key]
+        assert actor_id is not None, "multiple networks are available, please specify the actor ID explicitly"
+        network_key = self._actor_network_keys.get(actor_id)
+        if network_key is None:
+            network_key = actor_id if actor_id.step_key in self.substeps_with_separate_agent_nets \
+                else actor_id.step_key
+            self._actor_network_keys[actor_id] = network_key
+        return network_key
 
     def compute_substep_policy_output(self, observation: ObservationType, actor_id: ActorID = None,
                                       temperature: float = 1.0) -> PolicySubStepOutput:
@@ -169,25 +298,11 @@ class TorchPolicy(TorchModel, Policy):
         """
 
         # Convert the import to torch in-place
-        obs_t = convert_to_torch(observation, device=self._device, cast=None, in_place=True)
+        obs_t = self._maybe_convert_to_torch(observation)
 
         # Compute a forward pass of the policy network retrieving all the outputs (action logits + embedding logits if
         #  applicable)
-        network_out = self.network_for(actor_id)(obs_t)
-
-        # Disentangle action and embedding logits
-        if any([key not in self.distribution_mapper.action_space.spaces.keys() for key in
-                network_out.keys()]):
-
-            # Filter out the action logits
-            action_logits = dict(filter(lambda ii: ii[0] in self.distribution_mapper.action_space.spaces.keys(),
-                                        network_out.items()))
-            # Filter out the embedding logits
-            embedding_logits = dict(filter(lambda ii: ii[0] not in self.distribution_mapper.action_space.spaces.keys(),
-                                           network_out.items()))
-        else:
-            action_logits = network_out
-            embedding_logits = None
+        action_logits, embedding_logits = self._forward(self._network_key_for(actor_id), obs_t)
 
         # Initialize the probability distributions
         prob_dist = self.distribution_mapper.logits_dict_to_distribution(action_logits, temperature)
@@ -195,6 +310,252 @@ class TorchPolicy(TorchModel, Policy):
         return PolicySubStepOutput(action_logits=action_logits, prob_dist=prob_dist, embedding_logits=embedding_logits,
                                    actor_id=actor_id)
 
+    def _forward(self, network_key: Union[StepKeyType, ActorID], obs_t: Dict[str, torch.Tensor]) \
+            -> Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]:
+        """Compute the forward pass of the given network, using CUDA graph replay and mixed precision if configured.
+
+        :param network_key: Key of the network to run.
+        :param obs_t: The observation tensor dictionary.
+        :return: Tuple of action logits and embedding logits (None if the network has no embedding outputs).
+        """
+        if self._amp_dtype is None or self._device_type != "cuda":
+            return self._forward_network(network_key, obs_t)
+
+        with self._autocast():
+            action_logits, embedding_logits = self._forward_network(network_key, obs_t)
+
+        # distributions (and downstream critics) operate in full precision
+        action_logits = {k: v.float() for k, v in action_logits.items()}
+        if embedding_logits is not None:
+            embedding_logits = {k: v.float() for k, v in embedding_logits.items()}
+
+        return action_logits, embedding_logits
+
+    def _autocast(self) -> ContextManager:
+        """Context for running network forward passes, using mixed precision if configured.
+
+        :return: The autocast context, or a null context if mixed precision is not used.
+        """
+        if self._amp_dtype is None or self._device_type != "cuda":
+            return contextlib.nullcontext()
+
+        # captured cuda graphs must not reference autocast's cached weight casts, as these are freed on exit
+        return torch.autocast(device_type="cuda", dtype=self._amp_dtype, cache_enabled=not self._use_cuda_graphs)
+
+    def _forward_network(self, network_key: Union[StepKeyType, ActorID], obs_t: Dict[str, torch.Tensor]) \
+            -> Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]:
+        """Compute the forward pass of the given network, using CUDA graph replay if configured (autocast is handled
+        by the caller).
+
+        :param network_key: Key of the network to run.
+        :param obs_t: The observation tensor dictionary.
+        :return: Tuple of action logits and embedding logits (None if the network has no embedding outputs).
+        """
+        if self._use_cuda_graphs and not torch.is_grad_enabled() and self._device_type == "cuda":
+            return self._split_network_output(network_key, self._cuda_graph_forward(network_key, obs_t))
+
+        if self._compile_networks:
+            return self._forward_fn_for(network_key)(obs_t)
+
+        return self._split_network_output(network_key, self._forward_network_for(network_key)(obs_t))
+
+    def _split_network_output(self, network_key: Union[StepKeyType, ActorID],
+                              network_out: Dict[str, torch.Tensor]) \
+            -> Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]:
+        """Disentangle action and embedding logits.
+
+        As the output keys of a network are fixed, the partition into action and embedding keys is computed only once
+        per network.
+
+        :param network_key: Key of the network the output was computed with.
+        :param network_out: The output of a policy network.
+        :return: Tuple of action logits and embedding logits (None if the network has no embedding outputs).
+        """
+        partition = self._output_partitions.get(network_key)
+        if partition is None:
+            partition = (tuple(k for k in network_out.keys() if k in self._action_keys),
+                         tuple(k for k in network_out.keys() if k not in self._action_keys))
+            self._output_partitions[network_key] = partition
+
+        action_keys, embedding_keys = partition
+        if not embedding_keys:
+            return network_out, None
+
+        action_logits = {k: network_out[k] for k in action_keys}
+        embedding_logits = {k: network_out[k] for k in embedding_keys}
+        return action_logits, embedding_logits
+
+    def _forward_network_for(self, network_key: Union[StepKeyType, ActorID]) -> nn.Module:
+        """Get the network used for forward passes, scripting it on first use if configured.
+
+        Scripting happens lazily (and is repeated after device moves and state dict loads), as the scripted modules
+        do not follow buffer updates of the original networks (e.g., when moving them to a different device).
+
+        :param network_key: Key of the network.
+        :return: The (possibly scripted) network.
+        """
+        network = self._forward_networks.get(network_key)
+        if network is None:
+            network = self.networks[network_key]
+            if self._jit_script:
+                network = self._script_network(network)
+            self._forward_networks[network_key] = network
+        return network
+
+    def _forward_fn_for(self, network_key: Union[StepKeyType, ActorID]) \
+            -> Callable[[Dict[str, torch.Tensor]], Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]]:
+        """Get the compiled function computing the forward pass of the given network together with the split into
+        action and embedding logits, so that the split is part of the captured graph.
+
+        :param network_key: Key of the network to get the forward function for.
+        :return: The compiled forward function.
+        """
+        forward_fn = self._forward_fns.get(network_key)
+        if forward_fn is None:
+            network = self._forward_network_for(network_key)
+
+            def forward_fn(obs_t: Dict[str, torch.Tensor]) \
+                    -> Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]:
+                return self._split_network_output(network_key, network(obs_t))
+
+            forward_fn = self._clone_outputs(torch.compile(forward_fn, mode="reduce-overhead", dynamic=False))
+            self._forward_fns[network_key] = forward_fn
+
+        return forward_fn
+
+    def _sample_fn_for(self, network_key: Union[StepKeyType, ActorID]) \
+            -> Callable[[Dict[str, torch.Tensor], bool], Dict[str, torch.Tensor]]:
+        """Get the compiled function computing the forward pass of the given network together with action sampling,
+        for networks with categorical action heads only.
+
+        Sampling is done with the Gumbel-max trick on the logits instead of going through the distribution objects,
+        such that it is fused with the forward pass into a single graph.
+
+        :param network_key: Key of the network to get the sample function for.
+        :return: The compiled sample function, mapping observation tensors and the deterministic flag to actions.
+        """
+        sample_fn = self._sample_fns.get(network_key)
+        if sample_fn is None:
+            network = self._forward_network_for(network_key)
+
+            def fused_fn(obs_t: Dict[str, torch.Tensor], deterministic: bool) -> Dict[str, torch.Tensor]:
+                action_logits, _ = self._split_network_output(network_key, network(obs_t))
+                actions = dict()
+                for action_head, logits in action_logits.items():
+                    logits = logits.float()
+                    if not deterministic:
+                        logits = logits - torch.empty_like(logits).exponential_().log()
+                    actions[action_head] = logits.argmax(dim=-1)
+                return actions
+
+            compiled_fn = torch.compile(fused_fn, mode="reduce-overhead", dynamic=False)
+
+            def sample_fn(obs_t: Dict[str, torch.Tensor], deterministic: bool) -> Dict[str, torch.Tensor]:
+                # outputs of compiled functions live in static cuda graph memory (see _clone_outputs)
+                return {k: v.clone() for k, v in compiled_fn(obs_t, deterministic).items()}
+
+            self._sample_fns[network_key] = sample_fn
+
+        return sample_fn
+
+    @staticmethod
+    def _clone_outputs(compiled_fn: Callable[[Dict[str, torch.Tensor]],
+                                             Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]]) \
+            -> Callable[[Dict[str, torch.Tensor]], Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]]:
+        """Wrap a compiled forward function such that its outputs are cloned.
+
+        The outputs of functions compiled with mode="reduce-overhead" live in static cuda graph memory, which is
+        overwritten by subsequent calls (e.g., when computing the outputs of multiple sub-steps).
+
+        :param compiled_fn: The compiled forward function.
+        :return: The forward function returning cloned outputs.
+        """
+
+        def forward_fn(obs_t: Dict[str, torch.Tensor]) \
+                -> Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]:
+            action_logits, embedding_logits = compiled_fn(obs_t)
+            action_logits = {k: v.clone() for k, v in action_logits.items()}
+            if embedding_logits is not None:
+                embedding_logits = {k: v.clone() for k, v in embedding_logits.items()}
+            return action_logits, embedding_logits
+
+        return forward_fn
+
+    def _maybe_convert_to_torch(self, observation: ObservationType) -> Dict[str, torch.Tensor]:
+        """Convert the observation to torch (in-place), skipping the conversion if it already consists of
+        torch tensors located on the policy device.
+
+        :param observation: The observation to convert.
+        :return: The observation as torch tensor dictionary.
+        """
+        if isinstance(observation, dict) and all(isinstance(v, torch.Tensor) and v.device.type == self._device_type
+                                                 for v in observation.values()):
+            return observation
+
+        return convert_to_torch(observation, device=self._device, cast=None, in_place=True)
+
+    def _convert_to_torch_pinned(self, observation: ObservationType) -> ObservationType:
+        """Copy numpy observations to the policy device via pinned staging buffers and non-blocking copies.
+
+        Staging buffers are reused across calls. This is safe for the rollout path (see :meth:`compute_action`),
+        as converting the sampled action back to numpy synchronizes with the device before the next call.
+
+        :param observation: The numpy observation dictionary.
+        :return: The observation as torch tensor dictionary (or the unchanged observation if it is not a dictionary
+                 of numpy arrays).
+        """
+        if not isinstance(observation, dict) or not all(isinstance(v, np.ndarray) for v in observation.values()):
+            return observation
+
+        obs_t = dict()
+        for key, value in observation.items():
+            buffer_key = (key, value.shape, value.dtype)
+            pinned = self._pinned_buffers.get(buffer_key)
+            if pinned is None:
+                pinned = torch.from_numpy(value).pin_memory()
+                self._pinned_buffers[buffer_key] = pinned
+            else:
+                pinned.copy_(torch.from_numpy(value))
+            obs_t[key] = pinned.to(self._device, non_blocking=True)
+        return obs_t
+
+    def _cuda_graph_forward(self, network_key: Union[StepKeyType, ActorID],
+                            obs_t: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Run the forward pass of the given network by replaying a CUDA graph.
+
+        The graph is captured on first use for each network and observation shape signature.
+
+        :param network_key: Key of the network to run.
+        :param obs_t: The observation tensor dictionary.
+        :return: The network output (copied out of the static graph output buffers).
+        """
+        graph_key = (network_key, tuple((k, tuple(v.shape), v.dtype) for k, v in obs_t.items()))
+
+        if graph_key not in self._cuda_graphs:
+            network = self._forward_network_for(network_key)
+            static_in = {k: v.clone() for k, v in obs_t.items()}
+
+            # warm up on a side stream before capturing (as required by torch.cuda.graph)
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(3):
+                    network(static_in)
+            torch.cuda.current_stream().wait_stream(stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                static_out = network(static_in)
+            self._cuda_graphs[graph_key] = (graph, static_in, static_out)
+
+        graph, static_in, static_out = self._cuda_graphs[graph_key]
+        for k, v in obs_t.items():
+            static_in[k].copy_(v)
+        graph.replay()
+
+        # the static buffers are overwritten by the next replay
+        return {k: v.clone() for k, v in static_out.items()}
+
     def compute_policy_output(self, record: StructuredSpacesRecord, temperature: float = 1.0) -> PolicyOutput:
         """Compute the full Policy output for all policy networks over a full (flat) environment step.
 
@@ -203,8 +564,120 @@ class TorchPolicy(TorchModel, Policy):
         :return: The full Policy output for the record given.
         """
 
+        substep_records = record.substep_records
+
+        # convert the observations up front (on the current stream, as they might be used elsewhere later on)
+        observations = [self._maybe_convert_to_torch(substep_record.observation) for substep_record in substep_records]
+
+        # bucket the sub-steps by the network they use
+        network_buckets: Dict[Union[StepKeyType, ActorID], List[int]] = defaultdict(list)
+        for idx, substep_record in enumerate(substep_records):
+            network_buckets[self._network_key_for(substep_record.actor_id)].append(idx)
+
+        # the forward passes of different networks are independent, hence they are issued on separate cuda streams
+        streams = self._stream_pool() if self._device_type == "cuda" and len(network_buckets) > 1 else None
+        current_stream = torch.cuda.current_stream() if streams is not None else None
+
+        substep_logits: List[Optional[Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]]] = \
+            [None] * len(substep_records)
+        for bucket_idx, (network_key, indices) in enumerate(network_buckets.items()):
+            # on cpu (or for a single network) the forward passes are issued without touching torch.cuda at all
+            stream_context = contextlib.nullcontext()
+            if streams is not None:
+                stream = streams[bucket_idx % len(streams)]
+                stream.wait_stream(current_stream)
+                stream_context = torch.cuda.stream(stream)
+
+            with stream_context:
+                batched_logits = None
+                if len(indices) > 1 and self._is_batchable(network_key):
+                    batched_logits = self._batched_forward(network_key, [observations[idx] for idx in indices])
+
+                if batched_logits is not None:
+                    for idx, logits in zip(indices, batched_logits):
+                        substep_logits[idx] = logits
+                else:
+                    for idx in indices:
+                        substep_logits[idx] = self._forward(network_key, observations[idx])
+
+        # join the streams before the outputs are consumed on the current stream
+        if streams is not None:
+            for stream in streams[:len(network_buckets)]:
+                current_stream.wait_stream(stream)
+            for action_logits, embedding_logits in substep_logits:
+                for tensor in list(action_logits.values()) + list((embedding_logits or {}).values()):
+                    tensor.record_stream(current_stream)
+
         structured_policy_output = PolicyOutput()
-        for substep_record in record.substep_records:
-            structured_policy_output.append(self.compute_substep_policy_output(
-                substep_record.observation, actor_id=substep_record.actor_id, temperature=temperature))
+        for substep_record, (action_logits, embedding_logits) in zip(substep_records, substep_logits):
+            prob_dist = self.distribution_mapper.logits_dict_to_distribution(action_logits, temperature)
+            structured_policy_output.append(PolicySubStepOutput(action_logits=action_logits, prob_dist=prob_dist,
+                                                                embedding_logits=embedding_logits,
+                                                                actor_id=substep_record.actor_id))
         return structured_policy_output
+
+    def _stream_pool(self) -> List[torch.cuda.Stream]:
+        """Cuda streams for issuing the forward passes of the individual networks (created on first use).
+
+        :return: List of streams, one per network.
+        """
+        if not self._streams:
+            self._streams = [torch.cuda.Stream(device=self._device) for _ in range(len(self.networks))]
+        return self._streams
+
+    def _is_batchable(self, network_key: Union[StepKeyType, ActorID]) -> bool:
+        """Check if observations of multiple sub-steps can be passed through the given network in a single batch.
+
+        This is not the case for networks containing batch normalization layers (in training mode), as the batch
+        statistics would be computed across the sub-steps. The batch normalization layers are collected once per
+        network, hence only their training flags are checked on each call.
+
+        :param network_key: Key of the network to check.
+        :return: True if the network can process the observations of multiple sub-steps in a single batch.
+        """
+        if self._use_cuda_graphs and not torch.is_grad_enabled() and self._device_type == "cuda":
+            return False
+
+        batch_norm_layers = self._batch_norm_layers.get(network_key)
+        if batch_norm_layers is None:
+            batch_norm_layers = [module for module in self.networks[network_key].modules()
+                                 if isinstance(module, nn.modules.batchnorm._BatchNorm)]
+            self._batch_norm_layers[network_key] = batch_norm_layers
+
+        return not any(module.training for module in batch_norm_layers)
+
+    def _batched_forward(self, network_key: Union[StepKeyType, ActorID],
+                         observations: List[Dict[str, torch.Tensor]]) \
+            -> Optional[List[Tuple[Dict[str, torch.Tensor], Optional[Dict[str, torch.Tensor]]]]]:
+        """Compute the forward passes for multiple sub-steps sharing the same network with a single batch.
+
+        :param network_key: Key of the network shared by the sub-steps.
+        :param observations: The observation tensor dictionaries of the sub-steps.
+        :return: Tuples of action logits and embedding logits of the individual sub-steps, or None if the observations
+                 can not be batched.
+        """
+        # all observations need the same keys and a common leading batch dimension
+        keys = observations[0].keys()
+        if any(obs.keys() != keys for obs in observations):
+            return None
+        if any(obs[k].dim() == 0 or obs[k].shape[1:] != observations[0][k].shape[1:]
+               for obs in observations for k in keys):
+            return None
+        batch_sizes = [next(iter(obs.values())).shape[0] for obs in observations]
+        if any(obs[k].shape[0] != batch_size for obs, batch_size in zip(observations, batch_sizes) for k in keys):
+            return None
+
+        obs_batched = {k: torch.cat([obs[k] for obs in observations]) for k in keys}
+        action_logits, embedding_logits = self._forward(network_key, obs_batched)
+
+        action_logits_split = {k: torch.split(v, batch_sizes) for k, v in action_logits.items()}
+        embedding_logits_split = {k: torch.split(v, batch_sizes) for k, v in embedding_logits.items()} \
+            if embedding_logits is not None else None
+
+        substep_logits = []
+        for idx in range(len(observations)):
+            substep_action_logits = {k: v[idx] for k, v in action_logits_split.items()}
+            substep_embedding_logits = {k: v[idx] for k, v in embedding_logits_split.items()} \
+                if embedding_logits_split is not None else None
+            substep_logits.append((substep_action_logits, substep_embedding_logits))
+        return substep_logits
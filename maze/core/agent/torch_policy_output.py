@@ -6,6 +6,7 @@ import torch
 
 from maze.core.env.action_conversion import TorchActionType
 from maze.core.env.structured_env import ActorID
+from maze.distributions.categorical import CategoricalProbabilityDistribution
 from maze.distributions.dict import DictProbabilityDistribution
 
 
@@ -37,6 +38,15 @@ class PolicyOutput:
     def __init__(self):
         self._step_policy_outputs: List[PolicySubStepOutput] = list()
 
+        # per-field views on the sub-step outputs, maintained in append()
+        self._action_logits: List[Dict[str, torch.Tensor]] = list()
+        self._prob_dist: List[DictProbabilityDistribution] = list()
+        self._embedding_logits: List[Optional[Dict[str, torch.Tensor]]] = list()
+        self._actor_ids: List[ActorID] = list()
+
+        # entropies are only computed on first access
+        self._entropy_cache: Optional[List[torch.Tensor]] = None
+
     def __getitem__(self, item: int) -> PolicySubStepOutput:
         """Get a specified (by index) substep output"""
         return self._step_policy_outputs[item]
@@ -44,30 +54,37 @@ class PolicyOutput:
     def append(self, value: PolicySubStepOutput):
         """Append a given PolicySubStepOutput."""
         self._step_policy_outputs.append(value)
+        self._action_logits.append(value.action_logits)
+        self._prob_dist.append(value.prob_dist)
+        self._embedding_logits.append(value.embedding_logits)
+        self._actor_ids.append(value.actor_id)
+        self._entropy_cache = None
 
     def actor_ids(self) -> List[ActorID]:
         """List of actor IDs for the individual sub-steps."""
-        return list(map(lambda x: x.actor_id, self._step_policy_outputs))
+        return self._actor_ids
 
     @property
     def action_logits(self) -> List[Dict[str, torch.Tensor]]:
         """List of action logits for the individual sub-steps"""
-        return [po.action_logits for po in self._step_policy_outputs]
+        return self._action_logits
 
     @property
     def prob_dist(self) -> List[DictProbabilityDistribution]:
         """List of probability dictionaries for the individual sub-steps"""
-        return [po.prob_dist for po in self._step_policy_outputs]
+        return self._prob_dist
 
     @property
     def entropies(self) -> List[torch.Tensor]:
         """List of entropies (of the probability distribution of the individual sub-steps."""
-        return [po.entropy for po in self._step_policy_outputs]
+        if self._entropy_cache is None:
+            self._entropy_cache = [pd.entropy() for pd in self._prob_dist]
+        return self._entropy_cache
 
     @property
     def embedding_logits(self) -> List[Dict[str, torch.Tensor]]:
         """List of embedding logits for the individual sub-steps"""
-        return [po.embedding_logits for po in self._step_policy_outputs]
+        return self._embedding_logits
 
     def log_probs_for_actions(self, actions: List[TorchActionType]) -> List[TorchActionType]:
         """Compute the action log probs for given actions.
@@ -75,4 +92,51 @@ class PolicyOutput:
         :return: The computed action log probabilities.
         """
         assert len(self.prob_dist) == len(actions)
-        return [pb.log_prob(ac) for pb, ac in zip(self.prob_dist, actions)]
\ No newline at end of file
+        prob_dists = self.prob_dist
+        if len(prob_dists) < 2:
+            return [pb.log_prob(ac) for pb, ac in zip(prob_dists, actions)]
+
+        log_probs = [dict() for _ in prob_dists]
+        for action_head in prob_dists[0].distribution_dict.keys():
+            head_dists = [pb.distribution_dict.get(action_head) for pb in prob_dists]
+            head_actions = [ac.get(action_head) for ac in actions]
+
+            if self._is_batchable_categorical_head(head_dists, head_actions):
+                # a single gather over the stacked (already normalized) logits of all sub-steps
+                stacked_logits = torch.stack([dist.dist.logits for dist in head_dists])
+                stacked_actions = torch.stack(head_actions).long().unsqueeze(-1)
+                head_log_probs = stacked_logits.gather(-1, stacked_actions).squeeze(-1).unbind(0)
+            else:
+                head_log_probs = [dist.log_prob(ac) if dist is not None else None
+                                  for dist, ac in zip(head_dists, head_actions)]
+
+            for step_log_probs, log_prob in zip(log_probs, head_log_probs):
+                if log_prob is not None:
+                    step_log_probs[action_head] = log_prob
+
+        # sub-steps with action heads not present in the first sub-step are computed individually
+        for step_log_probs, pb, ac in zip(log_probs, prob_dists, actions):
+            for action_head, dist in pb.distribution_dict.items():
+                if action_head not in step_log_probs:
+                    step_log_probs[action_head] = dist.log_prob(ac[action_head])
+
+        return log_probs
+
+    @staticmethod
+    def _is_batchable_categorical_head(head_dists: List[Optional[CategoricalProbabilityDistribution]],
+                                       head_actions: List[Optional[torch.Tensor]]) -> bool:
+        """Check if the log probs of an action head can be computed in a single call across all sub-steps, i.e.,
+        if it is present in all sub-steps with categorical distributions of identical shape.
+
+        :param head_dists: The distributions of the action head in the individual sub-steps.
+        :param head_actions: The actions of the action head in the individual sub-steps.
+        :return: True if the action head can be batched.
+        """
+        if any(type(dist) is not CategoricalProbabilityDistribution for dist in head_dists):
+            return False
+        if any(not isinstance(ac, torch.Tensor) for ac in head_actions):
+            return False
+
+        logits_shape = head_dists[0].dist.logits.shape
+        return all(dist.dist.logits.shape == logits_shape and ac.shape == logits_shape[:-1]
+                   for dist, ac in zip(head_dists, head_actions))
\ No newline at end of file
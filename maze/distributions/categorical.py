@@ -34,6 +34,17 @@ class CategoricalProbabilityDistribution(TorchProbabilityDistribution[Categorica
         assert self.dist.logits.shape[:-1] == log_prob.shape
         return log_prob
 
+    @override(TorchProbabilityDistribution)
+    def entropy(self) -> torch.Tensor:
+        """implementation of :class:`~maze.distributions.distribution.ProbabilityDistribution` interface
+
+        Computed directly from the logits, which is cheaper than going through
+        :meth:`torch.distributions.Categorical.entropy`. As there, the log probabilities are clamped to the smallest
+        representable value, so that masked actions (probability of exactly 0) do not produce NaN gradients.
+        """
+        log_probs = torch.log_softmax(self.logits, dim=-1).clamp(min=torch.finfo(self.logits.dtype).min)
+        return -(log_probs.exp() * log_probs).sum(dim=-1)
+
     @override(TorchProbabilityDistribution)
     def deterministic_sample(self):
         """implementation of :class:`~maze.distributions.distribution.ProbabilityDistribution` interface
@@ -1,6 +1,16 @@
 """Torch policy mechanics tests."""
+from typing import Dict
+
 import pytest
+import torch
+from gym import spaces
 
+from maze.core.agent.torch_policy import TorchPolicy
+from maze.core.agent.torch_policy_output import PolicyOutput, PolicySubStepOutput
+from maze.core.env.structured_env import ActorID
+from maze.core.trajectory_recording.records.spaces_record import SpacesRecord
+from maze.core.trajectory_recording.records.structured_spaces_record import StructuredSpacesRecord
+from maze.distributions.distribution_mapper import DistributionMapper
 from maze.test.shared_test_utils.helper_functions import build_dummy_maze_env, \
     flatten_concat_probabilistic_policy_for_env, build_dummy_maze_environment_with_discrete_action_space
 
@@ -32,3 +42,249 @@ def test_torch_policy_with_discrete_only_action_space():
 
     for action in top_actions:
         assert all([key in env.action_space.spaces for key in action.keys()])
+
+
+def test_batched_log_probs_match_per_sub_step_log_probs():
+    action_space = spaces.Dict({"action_0": spaces.Discrete(3), "action_1": spaces.Box(low=-1, high=1, shape=(2,))})
+    distribution_mapper = DistributionMapper(action_space=action_space, distribution_mapper_config=[])
+
+    policy_output = PolicyOutput()
+    actions = []
+    for step_key in range(3):
+        logits = {"action_0": torch.randn(4, 3), "action_1": torch.randn(4, 4)}
+        prob_dist = distribution_mapper.logits_dict_to_distribution(logits, temperature=1.0)
+        policy_output.append(PolicySubStepOutput(action_logits=logits, prob_dist=prob_dist, embedding_logits=None,
+                                                 actor_id=ActorID(step_key, 0)))
+        actions.append(prob_dist.sample())
+
+    log_probs = policy_output.log_probs_for_actions(actions)
+    for step_log_probs, pb, ac in zip(log_probs, policy_output.prob_dist, actions):
+        expected = pb.log_prob(ac)
+        assert step_log_probs.keys() == expected.keys()
+        for key in expected:
+            assert torch.allclose(step_log_probs[key], expected[key])
+
+
+def _discrete_substep_output(distribution_mapper: DistributionMapper, actor_id: ActorID) -> PolicySubStepOutput:
+    logits = {"action_0": torch.randn(4, 3)}
+    prob_dist = distribution_mapper.logits_dict_to_distribution(logits, temperature=1.0)
+    return PolicySubStepOutput(action_logits=logits, prob_dist=prob_dist, embedding_logits=None, actor_id=actor_id)
+
+
+def test_policy_output_caches_entropies_until_append():
+    action_space = spaces.Dict({"action_0": spaces.Discrete(3)})
+    distribution_mapper = DistributionMapper(action_space=action_space, distribution_mapper_config=[])
+
+    policy_output = PolicyOutput()
+    first_output = _discrete_substep_output(distribution_mapper, ActorID(0, 0))
+    policy_output.append(first_output)
+
+    assert policy_output.actor_ids() == [ActorID(0, 0)]
+    assert policy_output.action_logits[0] is first_output.action_logits
+    assert policy_output.prob_dist[0] is first_output.prob_dist
+    assert policy_output.embedding_logits == [None]
+
+    entropies = policy_output.entropies
+    assert policy_output.entropies is entropies
+    assert policy_output.entropies[0] is entropies[0]
+
+    policy_output.append(_discrete_substep_output(distribution_mapper, ActorID(1, 0)))
+    updated_entropies = policy_output.entropies
+    assert updated_entropies is not entropies
+    assert len(updated_entropies) == 2
+    assert torch.allclose(updated_entropies[0], entropies[0])
+    assert policy_output.actor_ids() == [ActorID(0, 0), ActorID(1, 0)]
+
+
+class _LinearPolicyNet(torch.nn.Module):
+    """Minimal policy net mapping the observation to logits of a single discrete action head."""
+
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(3, 4)
+
+    def forward(self, xx):
+        return {"action": self.linear(xx["observation"])}
+
+
+def test_batched_policy_output_matches_per_sub_step_policy_output():
+    action_space = spaces.Dict({"action": spaces.Discrete(4)})
+    distribution_mapper = DistributionMapper(action_space=action_space, distribution_mapper_config=[])
+    policy = TorchPolicy(networks={0: _LinearPolicyNet()}, distribution_mapper=distribution_mapper, device="cpu")
+
+    substep_records = [SpacesRecord(actor_id=ActorID(0, agent_id), observation={"observation": torch.randn(5, 3)})
+                       for agent_id in range(2)]
+    policy_output = policy.compute_policy_output(StructuredSpacesRecord(substep_records=substep_records))
+
+    assert policy_output.actor_ids() == [ActorID(0, 0), ActorID(0, 1)]
+    for action_logits, substep_record in zip(policy_output.action_logits, substep_records):
+        expected = policy.compute_substep_policy_output(substep_record.observation, substep_record.actor_id)
+        assert torch.allclose(action_logits["action"], expected.action_logits["action"])
+
+
+def test_policy_output_of_multiple_networks_on_cpu_does_not_touch_cuda(monkeypatch):
+    def _no_cuda(*args, **kwargs):
+        raise AssertionError("torch.cuda must not be used on cpu")
+
+    for name in ["stream", "current_stream", "Stream"]:
+        monkeypatch.setattr(torch.cuda, name, _no_cuda)
+
+    policy = TorchPolicy(networks={0: _LinearPolicyNet(), 1: _LinearPolicyNet()},
+                         distribution_mapper=_discrete_distribution_mapper(), device="cpu")
+    substep_records = [SpacesRecord(actor_id=ActorID(step_key, 0), observation={"observation": torch.randn(5, 3)})
+                       for step_key in range(2)]
+    policy_output = policy.compute_policy_output(StructuredSpacesRecord(substep_records=substep_records))
+
+    assert policy_output.actor_ids() == [ActorID(0, 0), ActorID(1, 0)]
+
+
+class _ScriptablePolicyNet(torch.nn.Module):
+    """Scriptable policy net (including buffers, i.e. batch norm running stats)."""
+
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(3, 4)
+        self.norm = torch.nn.BatchNorm1d(4)
+
+    def forward(self, xx: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        return {"action": self.norm(self.linear(xx["observation"]))}
+
+
+class _NonScriptablePolicyNet(_LinearPolicyNet):
+    """Policy net with variadic forward arguments, which are not supported by torch.jit.script."""
+
+    def forward(self, *xx):
+        return super().forward(xx[0])
+
+
+def _discrete_distribution_mapper() -> DistributionMapper:
+    return DistributionMapper(action_space=spaces.Dict({"action": spaces.Discrete(4)}), distribution_mapper_config=[])
+
+
+def test_scripted_policy_matches_eager_network_after_loading_state():
+    trained_net = _ScriptablePolicyNet()
+    with torch.no_grad():
+        trained_net.norm.running_mean.uniform_()
+        trained_net.norm.running_var.uniform_(0.5, 2.0)
+    trained_net.eval()
+
+    policy = TorchPolicy(networks={0: _ScriptablePolicyNet()}, distribution_mapper=_discrete_distribution_mapper(),
+                         device="cpu", jit_script=True, rollout_only=True)
+    policy.load_state_dict(dict(policies={0: trained_net.state_dict()}))
+    policy.eval()
+
+    obs = {"observation": torch.randn(5, 3)}
+    with torch.no_grad():
+        policy_out = policy.compute_substep_policy_output(dict(obs), actor_id=ActorID(0, 0))
+        expected = trained_net(obs)["action"]
+
+    assert isinstance(policy._forward_network_for(0), torch.jit.ScriptModule)
+    assert torch.allclose(policy_out.action_logits["action"], expected)
+
+
+def test_scripted_policy_falls_back_to_non_scriptable_network():
+    network = _NonScriptablePolicyNet()
+    policy = TorchPolicy(networks={0: network}, distribution_mapper=_discrete_distribution_mapper(),
+                         device="cpu", jit_script=True, rollout_only=True)
+
+    obs = {"observation": torch.randn(5, 3)}
+    policy_out = policy.compute_substep_policy_output(dict(obs), actor_id=ActorID(0, 0))
+
+    assert policy._forward_network_for(0) is network
+    assert torch.allclose(policy_out.action_logits["action"], network(obs)["action"])
+
+
+def test_scripting_requires_rollout_only_policy():
+    with pytest.raises(ValueError):
+        TorchPolicy(networks={0: _ScriptablePolicyNet()}, distribution_mapper=_discrete_distribution_mapper(),
+                    device="cpu", jit_script=True)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires cuda")
+def test_mixed_precision_cuda_graph_replay_matches_eager_mixed_precision():
+    network = _LinearPolicyNet()
+    graph_policy = TorchPolicy(networks={0: network}, distribution_mapper=_discrete_distribution_mapper(),
+                               device="cuda", cuda_graphs=True, amp_dtype=torch.float16)
+    eager_policy = TorchPolicy(networks={0: _LinearPolicyNet()}, distribution_mapper=_discrete_distribution_mapper(),
+                               device="cuda", amp_dtype=torch.float16)
+
+    obs = {"observation": torch.randn(5, 3, device="cuda")}
+    for _ in range(2):
+        eager_policy.load_state_dict(graph_policy.state_dict())
+        with torch.no_grad():
+            # the first call captures the graph, the second one replays it
+            for _ in range(2):
+                graph_out = graph_policy.compute_substep_policy_output(dict(obs), actor_id=ActorID(0, 0))
+            eager_out = eager_policy.compute_substep_policy_output(dict(obs), actor_id=ActorID(0, 0))
+        assert torch.allclose(graph_out.action_logits["action"], eager_out.action_logits["action"])
+
+        # replay has to follow weight updates
+        with torch.no_grad():
+            network.linear.weight.add_(1.0)
+
+
+@pytest.mark.skipif(not hasattr(torch, "compile"), reason="requires torch >= 2.0")
+@pytest.mark.parametrize("device", ["cpu", pytest.param("cuda", marks=pytest.mark.skipif(
+    not torch.cuda.is_available(), reason="requires cuda"))])
+def test_compiled_policy_outputs_are_not_overwritten_by_later_calls(device: str):
+    network = _LinearPolicyNet()
+    policy = TorchPolicy(networks={0: network}, distribution_mapper=_discrete_distribution_mapper(),
+                         device=device, compile_networks=True)
+
+    observations = [{"observation": torch.randn(5, 3, device=device)} for _ in range(3)]
+    with torch.no_grad():
+        action_logits = [policy.compute_substep_policy_output(dict(obs), actor_id=ActorID(0, 0)).action_logits
+                         for obs in observations]
+        for logits, obs in zip(action_logits, observations):
+            assert torch.allclose(logits["action"], network(obs)["action"], atol=1e-6)
+
+
+@pytest.mark.skipif(not hasattr(torch, "compile"), reason="requires torch >= 2.0")
+def test_compiled_categorical_sampling_matches_distribution():
+    network = _LinearPolicyNet()
+    policy = TorchPolicy(networks={0: network}, distribution_mapper=_discrete_distribution_mapper(),
+                         device="cpu", compile_networks=True)
+
+    obs = {"observation": torch.randn(1, 3).repeat(20000, 1)}
+    with torch.no_grad():
+        probs = torch.softmax(network(obs)["action"][0], dim=-1)
+        expected_action = network(obs)["action"].argmax(dim=-1).numpy()
+
+    # the first call determines the action heads to be categorical, subsequent calls use the fused sample function
+    policy.compute_action(dict(obs), actor_id=ActorID(0, 0))
+    assert policy._categorical_only[0]
+
+    action = policy.compute_action(dict(obs), actor_id=ActorID(0, 0), deterministic=True)
+    assert (action["action"] == expected_action).all()
+
+    action = policy.compute_action(dict(obs), actor_id=ActorID(0, 0))
+    frequencies = torch.bincount(torch.from_numpy(action["action"]), minlength=4).float() / len(action["action"])
+    assert torch.allclose(frequencies, probs, atol=0.02)
+    assert 0 in policy._sample_fns
+
+
+def test_eager_policy_calls_networks_directly():
+    policy = TorchPolicy(networks={0: _LinearPolicyNet()}, distribution_mapper=_discrete_distribution_mapper(),
+                         device="cpu")
+    policy.compute_action({"observation": torch.randn(5, 3)}, actor_id=ActorID(0, 0))
+    policy.compute_action({"observation": torch.randn(5, 3)}, actor_id=ActorID(0, 0))
+
+    assert not policy._forward_fns and not policy._sample_fns and not policy._categorical_only
+
+
+def test_policy_output_is_not_batched_for_batch_norm_networks_in_training_mode():
+    network = _ScriptablePolicyNet()
+    policy = TorchPolicy(networks={0: network}, distribution_mapper=_discrete_distribution_mapper(), device="cpu")
+    policy.train()
+
+    substep_records = [SpacesRecord(actor_id=ActorID(0, agent_id), observation={"observation": torch.randn(5, 3)})
+                       for agent_id in range(2)]
+    policy_output = policy.compute_policy_output(StructuredSpacesRecord(substep_records=substep_records))
+
+    # batch statistics have to be computed per sub-step
+    assert not policy._is_batchable(0)
+    for action_logits, substep_record in zip(policy_output.action_logits, substep_records):
+        assert torch.allclose(action_logits["action"], network(substep_record.observation)["action"], atol=1e-6)
+
+    policy.eval()
+    assert policy._is_batchable(0)
@@ -45,6 +45,24 @@ def test_categorical_entropy():
     assert dist.entropy().numpy().shape == (100, 8)
 
 
+def test_categorical_entropy_matches_torch_categorical():
+    """ distribution test """
+    logits = torch.from_numpy(np.random.randn(100, 8, 5))
+    dist = CategoricalProbabilityDistribution(logits=logits, action_space=spaces.Discrete(5), temperature=0.5)
+    assert torch.allclose(dist.entropy(), dist.dist.entropy())
+
+    # masked logits (as produced by action masking) result in probabilities of exactly 0
+    logits = torch.from_numpy(np.random.randn(100, 8, 5).astype(np.float32))
+    logits[..., :2] += np.finfo(np.float32).min
+    logits.requires_grad_(True)
+    dist = CategoricalProbabilityDistribution(logits=logits, action_space=spaces.Discrete(5), temperature=1.0)
+    entropy = dist.entropy()
+    assert torch.allclose(entropy, dist.dist.entropy())
+
+    entropy.sum().backward()
+    assert torch.isfinite(logits.grad).all()
+
+
 def test_categorical_logprob():
     """ distribution test """
     logits = torch.from_numpy(np.random.randn(5))
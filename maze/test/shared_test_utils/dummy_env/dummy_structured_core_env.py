@@ -20,23 +20,40 @@ class DummyStructuredCoreEnvironment(CoreEnv):
         self.observation_space = observation_space
         self.current_agent = 0
 
+        # bounded float boxes can be sampled directly, bypassing the generic (masking) logic of Box.sample
+        self._fast_sample_keys = set()
+        if isinstance(observation_space, gym.spaces.Dict):
+            self._fast_sample_keys = {key for key, space in observation_space.spaces.items()
+                                      if isinstance(space, gym.spaces.Box) and space.dtype.kind == "f"
+                                      and space.is_bounded()}
+
     @override(CoreEnv)
     def step(self, maze_action: Dict) -> Tuple[Dict[str, np.ndarray], float, bool, Optional[Dict]]:
         """Switch agents, increment env step after the second agent"""
-        if self.current_agent == 0:
-            self.current_agent = 1
-            # No reward yet
+        prev_agent = self.current_agent
+        self.current_agent = prev_agent ^ 1
+
+        # No reward after the first agent. After the second one, increment env step and return reward of 2
+        # (sum for both agents). Info dicts are not shared, as wrappers might modify them.
+        if prev_agent == 0:
             return self.get_maze_state(), 0, False, {}
-        else:
-            # Increment env step, return reward of 2 (sum for both agents)
-            self.current_agent = 0
-            self.context.increment_env_step()
-            return self.get_maze_state(), 2, False, {}
+
+        self.context.increment_env_step()
+        return self.get_maze_state(), 2, False, {}
 
     @override(CoreEnv)
     def get_maze_state(self) -> Dict[str, np.ndarray]:
         """Sample a random observation."""
-        return self.observation_space.sample()
+        if not isinstance(self.observation_space, gym.spaces.Dict):
+            return self.observation_space.sample()
+
+        observation = dict()
+        for key, space in self.observation_space.spaces.items():
+            if key in self._fast_sample_keys:
+                observation[key] = space.np_random.uniform(space.low, space.high).astype(space.dtype, copy=False)
+            else:
+                observation[key] = space.sample()
+        return observation
 
     @override(CoreEnv)
     def reset(self) -> Dict[str, np.ndarray]:
@@ -1,6 +1,11 @@
+import functools
+
+import numpy as np
+
 from maze.core.agent.random_policy import DistributedRandomPolicy
+from maze.test.shared_test_utils.dummy_env.dummy_struct_env import DummyStructuredEnvironment
 from maze.test.shared_test_utils.helper_functions import build_dummy_structured_env
-from maze.train.parallelization.vector_env.subproc_vector_env import SubprocVectorEnv
+from maze.train.parallelization.vector_env.subproc_vector_env import SubprocVectorEnv, _SharedMemoryObservation
 
 
 def test_vectorized_rollout():
@@ -17,3 +22,64 @@ def test_vectorized_rollout():
     for _ in range(3):
         action = policy.compute_action(observation, actor_id=vectorized_env.actor_id(), maze_state=None)
         observation, reward, done, info = vectorized_env.step(action)
+
+
+def test_vectorized_async_rollout():
+    concurrency = 3
+    vectorized_env = SubprocVectorEnv([build_dummy_structured_env] * concurrency)
+    policy = DistributedRandomPolicy(vectorized_env.action_spaces_dict, concurrency=concurrency)
+
+    observation = vectorized_env.reset()
+    for _ in range(3):
+        action = policy.compute_action(observation, actor_id=vectorized_env.actor_id(), maze_state=None)
+        vectorized_env.step_async(action)
+        observation, reward, done, info = vectorized_env.step_wait()
+        assert reward.shape == (concurrency,)
+
+    vectorized_env.close()
+
+
+def _seeded_dummy_structured_env(seed: int) -> DummyStructuredEnvironment:
+    """Dummy structured env with a seeded observation space (the dummy env itself ignores seeding)."""
+    env = build_dummy_structured_env()
+    env.maze_env.core_env.observation_space.seed(seed)
+    return env
+
+
+def test_vectorized_rollout_with_shared_memory_observations():
+    concurrency = 3
+    env_factories = [functools.partial(_seeded_dummy_structured_env, seed) for seed in range(concurrency)]
+    shared_memory_env = SubprocVectorEnv(env_factories, shared_memory=True)
+    pipe_env = SubprocVectorEnv(env_factories, shared_memory=False)
+    assert shared_memory_env._shared_obs
+
+    # record what the workers actually sent
+    received_observations = []
+    stack_observations = shared_memory_env._stack_observations
+
+    def _spy_stack_observations(observations):
+        observations = list(observations)
+        received_observations.append(observations)
+        return stack_observations(observations)
+
+    shared_memory_env._stack_observations = _spy_stack_observations
+
+    policy = DistributedRandomPolicy(shared_memory_env.action_spaces_dict, concurrency=concurrency)
+
+    shared_memory_obs, pipe_obs = shared_memory_env.reset(), pipe_env.reset()
+    for _ in range(4):
+        assert shared_memory_obs.keys() == pipe_obs.keys()
+        for key in pipe_obs.keys():
+            assert shared_memory_obs[key].dtype == pipe_obs[key].dtype
+            assert np.array_equal(shared_memory_obs[key], pipe_obs[key])
+
+        action = policy.compute_action(pipe_obs, actor_id=pipe_env.actor_id(), maze_state=None)
+        shared_memory_obs, _, _, _ = shared_memory_env.step(action)
+        pipe_obs, _, _, _ = pipe_env.step(action)
+
+    # all observations fit the buffers, hence none of them should have been sent through the pipes
+    assert len(received_observations) == 5
+    assert all(isinstance(o, _SharedMemoryObservation) for observations in received_observations for o in observations)
+
+    shared_memory_env.close()
+    pipe_env.close()
@@ -2,6 +2,7 @@ import multiprocessing
 from typing import Callable, List, Iterable, Any, Tuple, Dict, Optional
 
 import cloudpickle
+import gym
 import matplotlib
 import numpy as np
 
@@ -9,6 +10,7 @@ from maze.core.annotations import override
 from maze.core.env.action_conversion import ActionType
 from maze.core.env.maze_env import MazeEnv
 from maze.core.env.observation_conversion import ObservationType
+from maze.core.env.structured_env import StepKeyType
 from maze.core.log_stats.log_stats import LogStatsLevel
 from maze.core.wrappers.log_stats_wrapper import LogStatsWrapper
 from maze.train.parallelization.vector_env.structured_vector_env import StructuredVectorEnv
@@ -17,7 +19,43 @@ from maze.train.parallelization.vector_env.vector_env_utils import disable_epoch
 from maze.train.utils.train_utils import stack_numpy_dict_list, unstack_numpy_list_dict
 
 
-def _worker(remote, parent_remote, env_fn_wrapper):
+class _SharedMemoryObservation:
+    """Placeholder shipped instead of an observation which has been written to the shared memory observation buffers.
+
+    :param step_key: The sub-step key of the buffers the observation has been written to.
+    """
+
+    def __init__(self, step_key: StepKeyType):
+        self.step_key = step_key
+
+
+def _write_shared_observation(shared_obs: Dict[StepKeyType, Dict[str, np.ndarray]], env_index: int,
+                              step_key: StepKeyType, observation: ObservationType) -> Any:
+    """Write the observation into the slot of the given env in the shared memory buffers of the given sub-step.
+
+    :param shared_obs: The shared memory observation arrays (with a leading n_envs dimension) per sub-step.
+    :param env_index: Index of the env writing the observation.
+    :param step_key: The sub-step the observation belongs to.
+    :param observation: The observation to write.
+    :return: A placeholder to ship instead of the observation, or the observation itself if it does not fit
+             the buffers (in which case it is shipped through the pipe as usual).
+    """
+    step_buffers = shared_obs.get(step_key)
+    if step_buffers is None or not isinstance(observation, dict) or observation.keys() != step_buffers.keys():
+        return observation
+
+    # only take the shared path if the observation exactly fits the buffers (no implicit casting or broadcasting)
+    for key, value in observation.items():
+        if not isinstance(value, np.ndarray) or value.shape != step_buffers[key].shape[1:] \
+                or value.dtype != step_buffers[key].dtype:
+            return observation
+
+    for key, value in observation.items():
+        step_buffers[key][env_index] = value
+    return _SharedMemoryObservation(step_key)
+
+
+def _worker(remote, parent_remote, env_fn_wrapper, env_index: int = 0):
     # switch to non-interactive matplotlib backend
     matplotlib.use('Agg')
 
@@ -31,6 +69,10 @@ def _worker(remote, parent_remote, env_fn_wrapper):
     # discard epoch-level statistics (as stats are shipped to the main process after each episode)
     env = disable_epoch_level_stats(env)
 
+    # shared memory observation buffers, if attached
+    shared_memories = []
+    shared_obs = None
+
     while True:
         try:
             cmd, data = remote.recv()
@@ -47,6 +89,10 @@ def _worker(remote, parent_remote, env_fn_wrapper):
                     # collect episode stats after the reset
                     episode_stats = env.get_stats(LogStatsLevel.EPISODE).last_stats
 
+                if shared_obs is not None:
+                    observation = _write_shared_observation(shared_obs, env_index, env.actor_id().step_key,
+                                                            observation)
+
                 remote.send((observation, reward, env_done, info, actor_done, actor_id, episode_stats,
                              env.get_env_time()))
             elif cmd == 'seed':
@@ -55,9 +101,15 @@ def _worker(remote, parent_remote, env_fn_wrapper):
                 observation = env.reset()
                 actor_done = env.is_actor_done()
                 actor_id = env.actor_id()
+                if shared_obs is not None:
+                    observation = _write_shared_observation(shared_obs, env_index, actor_id.step_key, observation)
                 remote.send((observation, actor_done, actor_id, env.get_stats(LogStatsLevel.EPISODE).last_stats,
                              env.get_env_time()))
+            elif cmd == 'attach_shared_memory':
+                shared_memories, shared_obs = _attach_shared_memory(data)
             elif cmd == 'close':
+                for shm in shared_memories:
+                    shm.close()
                 remote.close()
                 break
             elif cmd == 'get_spaces':
@@ -77,6 +129,26 @@ def _worker(remote, parent_remote, env_fn_wrapper):
             break
 
 
+def _attach_shared_memory(spec: Dict[StepKeyType, Dict[str, Tuple[str, Tuple[int, ...], np.dtype]]]) \
+        -> Tuple[List[Any], Dict[StepKeyType, Dict[str, np.ndarray]]]:
+    """Attach to the shared memory blocks described by the spec and create numpy views on them.
+
+    :param spec: Shared memory block name, shape and dtype per sub-step and observation key.
+    :return: Tuple of the attached shared memory blocks and the numpy views on them per sub-step.
+    """
+    from multiprocessing import shared_memory
+
+    shared_memories = []
+    shared_obs = dict()
+    for step_key, step_spec in spec.items():
+        shared_obs[step_key] = dict()
+        for key, (name, shape, dtype) in step_spec.items():
+            shm = shared_memory.SharedMemory(name=name)
+            shared_memories.append(shm)
+            shared_obs[step_key][key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shared_memories, shared_obs
+
+
 class CloudpickleWrapper(object):
     """
     Uses cloudpickle to serialize contents (otherwise multiprocessing tries to use pickle).
@@ -115,12 +187,16 @@ class SubprocVectorEnv(StructuredVectorEnv):
     :param start_method: Method used to start the subprocesses.
            Must be one of the methods returned by multiprocessing.get_all_start_methods().
            Defaults to 'forkserver' on available platforms, and 'spawn' otherwise.
+    :param shared_memory: If True, the workers write observations directly into shared memory buffers
+           (one per sub-step and observation key, holding the observations of all envs) instead of pickling them
+           through the pipes (requires python >= 3.8). Only applies to dict observation spaces.
     """
 
     def __init__(self,
                  env_factories: List[Callable[[], MazeEnv]],
                  logging_prefix: Optional[str] = None,
-                 start_method: str = None):
+                 start_method: str = None,
+                 shared_memory: bool = False):
         self.waiting = False
         self.closed = False
         n_envs = len(env_factories)
@@ -135,8 +211,9 @@ class SubprocVectorEnv(StructuredVectorEnv):
 
         self.remotes, self.work_remotes = zip(*[ctx.Pipe(duplex=True) for _ in range(n_envs)])
         self.processes = []
-        for work_remote, remote, env_fn in zip(self.work_remotes, self.remotes, env_factories):
-            args = (work_remote, remote, CloudpickleWrapper(env_fn))
+        for env_index, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes,
+                                                                      env_factories)):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), env_index)
             # daemon=True: if the main process crashes, we should not cause things to hang
             process = ctx.Process(target=_worker, args=args, daemon=True)  # pytype:disable=attribute-error
             process.start()
@@ -146,6 +223,11 @@ class SubprocVectorEnv(StructuredVectorEnv):
         self.remotes[0].send(('get_spaces', None))
         observation_spaces_dict, action_spaces_dict, agent_counts_dict = self.remotes[0].recv()
 
+        self._shared_memories = []
+        self._shared_obs: Optional[Dict[StepKeyType, Dict[str, np.ndarray]]] = None
+        if shared_memory:
+            self._init_shared_memory(observation_spaces_dict, n_envs)
+
         super().__init__(
             n_envs=n_envs,
             action_spaces_dict=action_spaces_dict,
@@ -174,9 +256,8 @@ class SubprocVectorEnv(StructuredVectorEnv):
         :param actions: the list of actions for the respective envs.
         :return: observations, rewards, dones, information-dicts all in env-aggregated form.
         """
-        actions = unstack_numpy_list_dict(actions)
-        self._step_async(actions)
-        return self._step_wait()
+        self.step_async(actions)
+        return self.step_wait()
 
     def reset(self) -> Dict[str, np.ndarray]:
         """VectorEnv implementation"""
@@ -184,6 +265,7 @@ class SubprocVectorEnv(StructuredVectorEnv):
             remote.send(('reset', None))
         results = [remote.recv() for remote in self.remotes]
         obs, actor_dones, actor_ids, episode_stats, env_times = zip(*results)
+        stacked_obs = self._stack_observations(obs)
 
         self._env_times = np.stack(env_times)
         self._actor_dones = np.stack(actor_dones)
@@ -194,7 +276,7 @@ class SubprocVectorEnv(StructuredVectorEnv):
             if stat is not None:
                 self.epoch_stats.receive(stat)
 
-        return stack_numpy_dict_list(obs)
+        return stacked_obs
 
     @override(VectorEnv)
     def seed(self, seeds: List[Any]) -> None:
@@ -213,9 +295,13 @@ class SubprocVectorEnv(StructuredVectorEnv):
             remote.send(('close', None))
         for process in self.processes:
             process.join()
+        for shm in self._shared_memories:
+            shm.close()
+            shm.unlink()
         self.closed = True
 
-    def _step_async(self, actions):
+    @override(VectorEnv)
+    def step_async(self, actions: ActionType) -> None:
         """
         Tell all the environments to start taking a step
         with the given actions.
@@ -224,11 +310,14 @@ class SubprocVectorEnv(StructuredVectorEnv):
         You should not call this if a step_async run is
         already pending.
         """
+        assert not self.waiting, "a step is already pending, call step_wait() first"
+        actions = unstack_numpy_list_dict(actions)
         for remote, action in zip(self.remotes, actions):
             remote.send(('step', action))
         self.waiting = True
 
-    def _step_wait(self) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, Iterable[Dict[Any, Any]]]:
+    @override(VectorEnv)
+    def step_wait(self) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, Iterable[Dict[Any, Any]]]:
         """
         Wait for the step taken with step_async().
 
@@ -237,6 +326,7 @@ class SubprocVectorEnv(StructuredVectorEnv):
         results = [remote.recv() for remote in self.remotes]
         self.waiting = False
         obs, rews, env_dones, infos, actor_dones, actor_ids, episode_stats, env_times = zip(*results)
+        stacked_obs = self._stack_observations(obs)
 
         self._env_times = np.stack(env_times)
         self._actor_dones = np.stack(actor_dones)
@@ -247,4 +337,54 @@ class SubprocVectorEnv(StructuredVectorEnv):
             if stat is not None:
                 self.epoch_stats.receive(stat)
 
-        return stack_numpy_dict_list(obs), np.stack(rews), np.stack(env_dones), infos
+        return stacked_obs, np.stack(rews), np.stack(env_dones), infos
+
+    def _init_shared_memory(self, observation_spaces_dict: Dict[StepKeyType, gym.spaces.Space], n_envs: int) -> None:
+        """Allocate the shared memory observation buffers and attach the workers to them.
+
+        :param observation_spaces_dict: The observation spaces of the envs.
+        :param n_envs: The number of envs.
+        """
+        from multiprocessing import shared_memory
+
+        spec = dict()
+        self._shared_obs = dict()
+        for step_key, space in observation_spaces_dict.items():
+            if not isinstance(space, gym.spaces.Dict) or \
+                    any(sub_space.shape is None or sub_space.dtype is None for sub_space in space.spaces.values()):
+                continue
+
+            spec[step_key] = dict()
+            self._shared_obs[step_key] = dict()
+            for key, sub_space in space.spaces.items():
+                shape, dtype = (n_envs,) + tuple(sub_space.shape), np.dtype(sub_space.dtype)
+                shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+                self._shared_memories.append(shm)
+                spec[step_key][key] = (shm.name, shape, dtype)
+                self._shared_obs[step_key][key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+        for remote in self.remotes:
+            remote.send(('attach_shared_memory', spec))
+
+    def _stack_observations(self, observations: Iterable[Any]) -> Dict[str, np.ndarray]:
+        """Stack the observations received from the workers, reading them from the shared memory buffers
+        where applicable.
+
+        The result is always a copy, as the buffers are overwritten by the next step.
+
+        :param observations: The observations (or shared memory placeholders) received from the workers.
+        :return: The observations in env-aggregated form.
+        """
+        observations = list(observations)
+        if self._shared_obs is None or not any(isinstance(o, _SharedMemoryObservation) for o in observations):
+            return stack_numpy_dict_list(observations)
+
+        step_keys = set(o.step_key for o in observations if isinstance(o, _SharedMemoryObservation))
+        if len(step_keys) == 1 and all(isinstance(o, _SharedMemoryObservation) for o in observations):
+            # all envs wrote into the same buffers, so the buffers already hold the stacked form
+            return {k: v.copy() for k, v in self._shared_obs[step_keys.pop()].items()}
+
+        for env_index, o in enumerate(observations):
+            if isinstance(o, _SharedMemoryObservation):
+                observations[env_index] = {k: v[env_index] for k, v in self._shared_obs[o.step_key].items()}
+        return stack_numpy_dict_list(observations)
@@ -29,6 +29,7 @@ class VectorEnv(BaseEnv, ABC):
 
     def __init__(self, n_envs: int):
         self.n_envs = n_envs
+        self._pending_actions = None
 
     @abstractmethod
     def step(self, actions: ActionType
@@ -39,6 +40,27 @@ class VectorEnv(BaseEnv, ABC):
         :return: observations, rewards, dones, information-dicts all in env-aggregated form.
         """
 
+    def step_async(self, actions: ActionType) -> None:
+        """Dispatch the given actions to the environments without waiting for the results.
+
+        The results are collected with :meth:`step_wait`. This allows for overlapping the environment steps with
+        other work (e.g., policy computations). Implementations which can not step asynchronously fall back to
+        stepping synchronously in :meth:`step_wait`.
+
+        :param actions: the list of actions for the respective envs.
+        """
+        assert self._pending_actions is None, "a step is already pending, call step_wait() first"
+        self._pending_actions = actions
+
+    def step_wait(self) -> Tuple[ObservationType, np.ndarray, np.ndarray, Iterable[Dict[Any, Any]]]:
+        """Wait for the step dispatched with :meth:`step_async`.
+
+        :return: observations, rewards, dones, information-dicts all in env-aggregated form.
+        """
+        assert self._pending_actions is not None, "no step is pending, call step_async() first"
+        actions, self._pending_actions = self._pending_actions, None
+        return self.step(actions)
+
     @abstractmethod
     def reset(self):
         """Reset all the environments and return respective observations in env-aggregated form.